@@ -1,29 +1,37 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, Depends, UploadFile
+from fastapi import APIRouter, Depends, Query, UploadFile
 from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlmodel import Session
 
+from app.broadcast import raffle_channel, stream_events
 from app.crud import (
     insert_role,
     insert_user,
+    select_raffle_by_id,
+    select_raffle_numbers,
     select_role_by_id,
     select_roles,
     select_user_by_id,
+    select_user_raffles,
     select_users,
     update_password,
     update_user,
 )
-from app.database import get_session
+from app.database import engine, get_session
+from app.jobs import insert_job, select_job_by_id, select_queue_depth
 from app.models import (
     APIToken,
+    JobRead,
     Role,
     RoleCreate,
     PasswordChange,
     User,
     UserCreate,
+    UserRafflesPage,
     UserRead,
     UserUpdate,
 )
@@ -33,7 +41,7 @@ from app.security import (
     create_jwt,
     get_current_active_user,
 )
-from app.utilities import save_user_image
+from app.utilities import stage_upload
 
 router = APIRouter()
 
@@ -41,6 +49,7 @@ allow_manage_users = RoleChecker(allowed_roles=["user_manager"])
 allow_create_raffles = RoleChecker(allowed_roles=["raffle_creator"])
 allow_buy_raffles = RoleChecker(allowed_roles=["raffle_buyer"])
 
+
 @router.get(
     "/users/", response_model=List[UserRead], dependencies=[Depends(allow_manage_users)]
 )
@@ -51,7 +60,8 @@ async def get_users(
 
 
 @router.post(
-    "/users/", response_model=UserRead, #dependencies=[Depends(allow_manage_users)]
+    "/users/",
+    response_model=UserRead,  # dependencies=[Depends(allow_manage_users)]
 )
 async def create_user(
     user_data: UserCreate,
@@ -80,6 +90,16 @@ async def change_password_me(
     return user
 
 
+@router.get("/users/me/raffles", response_model=UserRafflesPage)
+async def get_user_me_raffles(
+    before: Optional[int] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    return user_raffles_page(user.id, before, limit, session)
+
+
 @router.get(
     "/users/{user_id}",
     response_model=UserRead,
@@ -106,9 +126,36 @@ async def edit_user(
         raise HTTPException(status_code=404, detail="User not found")
 
 
+@router.get(
+    "/users/{user_id}/raffles",
+    response_model=UserRafflesPage,
+    dependencies=[Depends(allow_manage_users)],
+)
+async def get_user_raffles(
+    user_id: int,
+    before: Optional[int] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    try:
+        select_user_by_id(user_id, session)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_raffles_page(user_id, before, limit, session)
+
+
+def user_raffles_page(
+    user_id: int, before: Optional[int], limit: int, session: Session
+) -> UserRafflesPage:
+    items = select_user_raffles(user_id, session, before=before, limit=limit)
+    next_cursor = items[-1].id if len(items) == limit else None
+    return UserRafflesPage(items=items, next_cursor=next_cursor)
+
+
 @router.post(
     "/users/{user_id}/image",
-    response_model=UserRead,
+    response_model=JobRead,
+    status_code=202,
     dependencies=[Depends(allow_manage_users)],
 )
 async def set_user_image(
@@ -116,9 +163,38 @@ async def set_user_image(
 ):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File is not an image")
-    image_path = save_user_image(user_id, file)
+    try:
+        select_user_by_id(user_id, session)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="User not found")
+    staged_path = stage_upload(file)
+
+    return insert_job(
+        "store_user_image",
+        {"user_id": user_id, "staged_path": staged_path, "filename": file.filename},
+        session,
+    )
+
+
+@router.get(
+    "/jobs/metrics",
+    response_model=Dict[str, Dict[str, int]],
+    dependencies=[Depends(allow_manage_users)],
+)
+async def get_jobs_metrics(session: Session = Depends(get_session)):
+    return select_queue_depth(session)
 
-    return update_user(user_id, UserUpdate(image_path=f"/{image_path}"), session)
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobRead,
+    dependencies=[Depends(allow_manage_users)],
+)
+async def get_job(job_id: int, session: Session = Depends(get_session)):
+    try:
+        return select_job_by_id(job_id, session)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Job not found")
 
 
 @router.get("/roles/", response_model=List[Role])
@@ -135,17 +211,65 @@ async def get_role(role_id: int, session: Session = Depends(get_session)):
 
 
 @router.post(
-    "/roles/", response_model=Role, #dependencies=[Depends(allow_manage_users)]
+    "/roles/",
+    response_model=Role,  # dependencies=[Depends(allow_manage_users)]
 )
-async def create_role(
-    role_data: RoleCreate, session: Session = Depends(get_session)
-):
+async def create_role(role_data: RoleCreate, session: Session = Depends(get_session)):
     try:
         return insert_role(role_data, session)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Role already exists")
 
 
+@router.get("/raffles/{raffle_id}/numbers", response_model=List[int])
+async def get_raffle_numbers(raffle_id: int, session: Session = Depends(get_session)):
+    try:
+        raffle = select_raffle_by_id(raffle_id, session)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Raffle not found")
+    return select_raffle_numbers(raffle, session)
+
+
+@router.post(
+    "/raffles/{raffle_id}/archive",
+    response_model=JobRead,
+    status_code=202,
+    dependencies=[Depends(allow_create_raffles)],
+)
+async def archive_raffle(
+    raffle_id: int,
+    user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    try:
+        raffle = select_raffle_by_id(raffle_id, session)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Raffle not found")
+    if raffle.created_by != user.id:
+        raise HTTPException(status_code=403, detail="Operation not permited")
+    if raffle.state:
+        raise HTTPException(status_code=400, detail="Raffle is still open")
+    if raffle.archived:
+        raise HTTPException(status_code=409, detail="Raffle is already archived")
+    return insert_job("archive_raffle", {"raffle_id": raffle_id}, session)
+
+
+@router.get("/raffles/{raffle_id}/events")
+async def get_raffle_events(raffle_id: int):
+    # A short-lived session, the stream would otherwise hold a connection open.
+    with Session(engine) as session:
+        try:
+            select_raffle_by_id(raffle_id, session)
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Raffle not found")
+
+    return StreamingResponse(
+        stream_events(raffle_channel(raffle_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/token", response_model=APIToken)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -154,4 +278,3 @@ async def login(
     user = authenticate_user(form_data.username, form_data.password, session)
     token = create_jwt({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
-
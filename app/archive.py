@@ -0,0 +1,144 @@
+import logging
+from typing import List
+
+from sqlalchemy import delete, insert, select
+from sqlmodel import Session
+
+from app.config import settings
+from app.crud import select_raffle_by_id
+from app.database import engine
+from app.models import (
+    Raffle,
+    RaffleRewards,
+    RaffleRewardsArchive,
+    RaffleUserLink,
+    RaffleUserLinkArchive,
+    RewardUserLink,
+    RewardUserLinkArchive,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RaffleStillOpen(Exception):
+    pass
+
+
+def select_archivable_raffle_ids(session: Session) -> List[int]:
+    query = (
+        select(Raffle.id)
+        .where(Raffle.state.is_(False), Raffle.archived.is_(False))
+        .order_by(Raffle.id)
+    )
+    return session.execute(query).scalars().all()
+
+
+def archive_raffle_tickets_batch(
+    raffle_id: int, batch_size: int, session: Session
+) -> int:
+    query = (
+        select(RaffleUserLink.id)
+        .where(RaffleUserLink.raffle_id == raffle_id)
+        .order_by(RaffleUserLink.id)
+        .limit(batch_size)
+    )
+    ticket_ids = session.execute(query).scalars().all()
+    if not ticket_ids:
+        return 0
+
+    columns = ["id", "price", "buyed_number", "raffle_id", "user_id"]
+    session.execute(
+        insert(RaffleUserLinkArchive).from_select(
+            columns,
+            select(
+                RaffleUserLink.id,
+                RaffleUserLink.price,
+                RaffleUserLink.buyed_number,
+                RaffleUserLink.raffle_id,
+                RaffleUserLink.user_id,
+            ).where(
+                RaffleUserLink.raffle_id == raffle_id,
+                RaffleUserLink.id.in_(ticket_ids),
+            ),
+        )
+    )
+    session.execute(
+        delete(RaffleUserLink)
+        .where(RaffleUserLink.raffle_id == raffle_id, RaffleUserLink.id.in_(ticket_ids))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+    return len(ticket_ids)
+
+
+def archive_raffle_rewards(raffle_id: int, session: Session) -> int:
+    # Rewards and their winners move together, a raffle has only a handful.
+    reward_ids = select(RaffleRewards.id).where(RaffleRewards.raffle_id == raffle_id)
+    session.execute(
+        insert(RewardUserLinkArchive).from_select(
+            ["id", "reward_id", "user_id"],
+            select(
+                RewardUserLink.id, RewardUserLink.reward_id, RewardUserLink.user_id
+            ).where(RewardUserLink.reward_id.in_(reward_ids)),
+        )
+    )
+    session.execute(
+        delete(RewardUserLink)
+        .where(RewardUserLink.reward_id.in_(reward_ids))
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        insert(RaffleRewardsArchive).from_select(
+            ["id", "raffle_id", "name"],
+            select(RaffleRewards.id, RaffleRewards.raffle_id, RaffleRewards.name).where(
+                RaffleRewards.raffle_id == raffle_id
+            ),
+        )
+    )
+    result = session.execute(
+        delete(RaffleRewards)
+        .where(RaffleRewards.raffle_id == raffle_id)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+    return result.rowcount
+
+
+def archive_raffle(
+    raffle_id: int, session: Session, batch_size: int = settings.archive_batch_size
+) -> int:
+    raffle = select_raffle_by_id(raffle_id, session)
+    if raffle.state:
+        raise RaffleStillOpen()
+    if raffle.archived:
+        return 0
+
+    # Every batch is its own short transaction, so purchases on live raffles
+    # never wait behind the archival of a large one.
+    archived = 0
+    while True:
+        moved = archive_raffle_tickets_batch(raffle_id, batch_size, session)
+        if not moved:
+            break
+        archived += moved
+    archive_raffle_rewards(raffle_id, session)
+
+    raffle = select_raffle_by_id(raffle_id, session)
+    raffle.archived = True
+    session.commit()
+    logger.info("Archived raffle %s, %s tickets moved", raffle_id, archived)
+
+    return archived
+
+
+def main() -> None:
+    with Session(engine) as session:
+        for raffle_id in select_archivable_raffle_ids(session):
+            archive_raffle(raffle_id, session)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, Dict[str, Any]], None]
+
+
+# Delivers events within the current process only, enough for a single worker
+# and for tests.
+class LocalBackend:
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, channel: str, event: Dict[str, Any]) -> None:
+        self._on_message(channel, event)
+
+
+# Fans events out to every worker through LISTEN/NOTIFY.
+class PostgresBackend:
+    pg_channel = "raffle_events"
+    max_backoff = 30.0
+
+    def __init__(self, database_url: str = settings.database_url) -> None:
+        # psycopg2 does not understand SQLAlchemy driver names such as
+        # postgresql+psycopg2://.
+        self.dsn = (
+            make_url(database_url)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._publish_lock = threading.Lock()
+        self._publisher = None
+
+    async def start(self, on_message: MessageHandler) -> None:
+        loop = asyncio.get_running_loop()
+        connection = await loop.run_in_executor(None, self._listen_connection)
+
+        def listen() -> None:
+            nonlocal connection
+            backoff = 0.5
+            while not self._stopping.is_set():
+                try:
+                    if connection is None:
+                        connection = self._listen_connection()
+                        logger.info("Reconnected to %s", self.pg_channel)
+                        backoff = 0.5
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                except Exception:
+                    # Events sent while disconnected are lost, clients reload
+                    # the raffle state when their stream reconnects.
+                    logger.exception(
+                        "Lost %s listener, reconnecting in %.1fs",
+                        self.pg_channel,
+                        backoff,
+                    )
+                    self._close(connection)
+                    connection = None
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                        loop.call_soon_threadsafe(
+                            on_message, message["channel"], message["event"]
+                        )
+                    except Exception:
+                        logger.exception("Invalid %s payload", self.pg_channel)
+            self._close(connection)
+
+        self._listener = threading.Thread(target=listen, daemon=True)
+        self._listener.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._listener is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._listener.join)
+        with self._publish_lock:
+            self._close(self._publisher)
+            self._publisher = None
+
+    async def publish(self, channel: str, event: Dict[str, Any]) -> None:
+        payload = json.dumps({"channel": channel, "event": event})
+        await asyncio.get_running_loop().run_in_executor(None, self._notify, payload)
+
+    def _listen_connection(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.pg_channel}")
+        return connection
+
+    def _notify(self, payload: str) -> None:
+        with self._publish_lock:
+            if self._publisher is None or self._publisher.closed:
+                self._publisher = psycopg2.connect(self.dsn)
+                self._publisher.autocommit = True
+            try:
+                with self._publisher.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT pg_notify(%s, %s)", (self.pg_channel, payload)
+                    )
+            except psycopg2.OperationalError:
+                # The next publish opens a fresh connection.
+                self._close(self._publisher)
+                self._publisher = None
+                raise
+
+    @staticmethod
+    def _close(connection) -> None:
+        if connection is None:
+            return
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class Subscription:
+    def __init__(self, channel: str, queue_size: int) -> None:
+        self.channel = channel
+        self.queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(queue_size)
+        self.dropped = False
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        backend=None,
+        batch_interval: float = settings.broadcast_batch_interval,
+        queue_size: int = settings.broadcast_queue_size,
+    ) -> None:
+        self.backend = backend if backend is not None else LocalBackend()
+        self.batch_interval = batch_interval
+        self.queue_size = queue_size
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.backend.start(self._on_message)
+        self._flusher = asyncio.ensure_future(self._flush_forever())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.backend.stop()
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                self._close(subscription)
+        self._subscriptions.clear()
+
+    async def publish(self, channel: str, event: Dict[str, Any]) -> None:
+        await self.backend.publish(channel, event)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[Subscription]:
+        subscription = Subscription(channel, self.queue_size)
+        self._subscriptions.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def _on_message(self, channel: str, event: Dict[str, Any]) -> None:
+        if channel in self._subscriptions:
+            self._pending.setdefault(channel, []).append(event)
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.channel)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.channel]
+
+    def _close(self, subscription: Subscription) -> None:
+        subscription.dropped = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not flush broadcast events")
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for channel, events in pending.items():
+            # The batch is encoded once and shared by every subscriber.
+            chunk = encode_events(coalesce_events(events))
+            for subscription in list(self._subscriptions.get(channel, ())):
+                try:
+                    subscription.queue.put_nowait(chunk)
+                except asyncio.QueueFull:
+                    # Slow consumers are disconnected, clients reconnect and
+                    # reload the raffle state instead of receiving a backlog.
+                    self._unsubscribe(subscription)
+                    self._close(subscription)
+
+
+def coalesce_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    numbers_sold: List[int] = []
+    coalesced: List[Dict[str, Any]] = []
+    for event in events:
+        if event["type"] == "numbers_sold":
+            numbers_sold.extend(event["numbers"])
+        else:
+            coalesced.append(event)
+    if numbers_sold:
+        coalesced.insert(0, {"type": "numbers_sold", "numbers": sorted(numbers_sold)})
+    return coalesced
+
+
+def encode_events(events: List[Dict[str, Any]]) -> bytes:
+    return "".join(
+        f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+        for event in events
+    ).encode()
+
+
+def raffle_channel(raffle_id: int) -> str:
+    return f"raffle:{raffle_id}"
+
+
+def get_backend():
+    if settings.broadcast_backend == "postgres":
+        return PostgresBackend()
+    return LocalBackend()
+
+
+broadcaster = Broadcaster(get_backend())
+
+
+async def publish_numbers_sold(raffle_id: int, numbers: List[int]) -> None:
+    await broadcaster.publish(
+        raffle_channel(raffle_id), {"type": "numbers_sold", "numbers": numbers}
+    )
+
+
+async def publish_draw_result(raffle_id: int, results: List[Dict[str, Any]]) -> None:
+    await broadcaster.publish(
+        raffle_channel(raffle_id), {"type": "draw", "results": results}
+    )
+
+
+async def stream_events(
+    channel: str, keepalive: float = 15.0, source: Optional[Broadcaster] = None
+) -> AsyncIterator[bytes]:
+    source = source if source is not None else broadcaster
+    async with source.subscribe(channel) as subscription:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                chunk = await asyncio.wait_for(subscription.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if chunk is None:
+                return
+            yield chunk
@@ -5,6 +5,23 @@ class Settings(BaseSettings):
     database_url: str
     secret_key: str
     storage_dir: str
+    staging_dir: str = "staging"
+
+    jobs_in_process: bool = True
+    jobs_concurrency: int = 4
+    jobs_poll_interval: float = 1.0
+    jobs_lock_timeout: int = 600
+
+    idempotency_backend: str = "memory"
+    idempotency_ttl: int = 86400
+    idempotency_max_keys: int = 10000
+    idempotency_wait_timeout: float = 30.0
+
+    broadcast_backend: str = "local"
+    broadcast_batch_interval: float = 0.05
+    broadcast_queue_size: int = 64
+
+    archive_batch_size: int = 1000
 
     class Config:
         env_file = ".env"
@@ -1,15 +1,27 @@
-from typing import List, Optional
+import json
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import select, union_all
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from sqlmodel import Session
 
 from app.models import (
+    Raffle,
+    RaffleRewardRead,
+    RaffleRewards,
+    RaffleRewardsArchive,
+    RaffleUserLink,
+    RaffleUserLinkArchive,
+    RewardUserLink,
+    RewardUserLinkArchive,
     Role,
     RoleCreate,
     PasswordChange,
     User,
     UserCreate,
+    UserRaffles,
     UserUpdate,
 )
 from app.security import auth_exception, hash_password, verify_password
@@ -92,3 +104,144 @@ def insert_role(role: RoleCreate, session: Session) -> Role:
 
     return role_db
 
+
+def select_raffle_by_id(raffle_id: int, session: Session) -> Raffle:
+    query = select(Raffle).where(Raffle.id == raffle_id)
+    return session.execute(query).scalar_one()
+
+
+class json_array_agg(FunctionElement):
+    name = "json_array_agg"
+    inherit_cache = True
+
+
+@compiles(json_array_agg, "postgresql")
+def _compile_json_array_agg_postgresql(element, compiler, **kw):
+    return f"json_agg({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array_agg, "sqlite")
+def _compile_json_array_agg_sqlite(element, compiler, **kw):
+    return f"json_group_array({compiler.process(element.clauses, **kw)})"
+
+
+class json_array(FunctionElement):
+    name = "json_array"
+    inherit_cache = True
+
+
+@compiles(json_array, "postgresql")
+def _compile_json_array_postgresql(element, compiler, **kw):
+    return f"json_build_array({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array, "sqlite")
+def _compile_json_array_sqlite(element, compiler, **kw):
+    return f"json_array({compiler.process(element.clauses, **kw)})"
+
+
+def _load_json_array(value) -> list:
+    # psycopg2 decodes json columns, SQLite hands them back as text.
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def select_raffle_numbers(raffle: Raffle, session: Session) -> List[int]:
+    query = select(RaffleUserLink.buyed_number).where(
+        RaffleUserLink.raffle_id == raffle.id
+    )
+    if not raffle.state:
+        # Closed raffles may have been moved, fully or partly, to the archive.
+        query = union_all(
+            query,
+            select(RaffleUserLinkArchive.buyed_number).where(
+                RaffleUserLinkArchive.raffle_id == raffle.id
+            ),
+        )
+    return sorted(session.execute(query).scalars().all())
+
+
+def _select_user_tickets(
+    tickets, user_id: int, session: Session, before: Optional[int], limit: int
+) -> list:
+    query = (
+        select(
+            tickets.raffle_id,
+            json_array_agg(json_array(tickets.id, tickets.buyed_number, tickets.price)),
+        )
+        .where(tickets.user_id == user_id)
+        .group_by(tickets.raffle_id)
+        .order_by(tickets.raffle_id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(tickets.raffle_id < before)
+    return session.execute(query).all()
+
+
+def _select_user_rewards(
+    rewards, winners, user_id: int, raffle_ids: List[int], session: Session
+) -> list:
+    # A raffle has a handful of rewards, they are read by raffle and the
+    # winner is checked here instead of walking every reward the user won.
+    query = (
+        select(rewards.raffle_id, rewards.id, rewards.name, winners.user_id)
+        .join(winners, winners.reward_id == rewards.id)
+        .where(rewards.raffle_id.in_(raffle_ids))
+    )
+    return [
+        (raffle_id, reward_id, name)
+        for raffle_id, reward_id, name, winner_id in session.execute(query)
+        if winner_id == user_id
+    ]
+
+
+def select_user_raffles(
+    user_id: int, session: Session, before: Optional[int] = None, limit: int = 20
+) -> List[UserRaffles]:
+    # Live and archived tickets are paged separately on their (user_id,
+    # raffle_id) indexes and merged here, so every query reads at most one
+    # page. Rows only move from the live tables to the archive and keep
+    # their ids, so reading the live side first may see a row on both sides
+    # but never misses one; they are merged by id.
+    tickets: Dict[int, Dict[int, Tuple[int, int]]] = {}
+    for table in (RaffleUserLink, RaffleUserLinkArchive):
+        for raffle_id, raffle_tickets in _select_user_tickets(
+            table, user_id, session, before, limit
+        ):
+            tickets.setdefault(raffle_id, {}).update(
+                (ticket_id, (number, price))
+                for ticket_id, number, price in _load_json_array(raffle_tickets)
+            )
+    raffle_ids = sorted(tickets, reverse=True)[:limit]
+    if not raffle_ids:
+        return []
+
+    rewards: Dict[int, Dict[int, RaffleRewardRead]] = {
+        raffle_id: {} for raffle_id in raffle_ids
+    }
+    for reward_table, winner_table in (
+        (RaffleRewards, RewardUserLink),
+        (RaffleRewardsArchive, RewardUserLinkArchive),
+    ):
+        for raffle_id, reward_id, name in _select_user_rewards(
+            reward_table, winner_table, user_id, raffle_ids, session
+        ):
+            rewards[raffle_id][reward_id] = RaffleRewardRead(id=reward_id, name=name)
+
+    query = select(Raffle).where(Raffle.id.in_(raffle_ids)).order_by(Raffle.id.desc())
+    return [
+        UserRaffles(
+            **raffle.dict(),
+            total_spent=sum(price for _, price in tickets[raffle.id].values()),
+            numbers_bought=sorted(number for number, _ in tickets[raffle.id].values()),
+            winned_rewards=[
+                rewards[raffle.id][reward_id]
+                for reward_id in sorted(rewards[raffle.id])
+            ],
+        )
+        for raffle in session.execute(query).scalars()
+    ]
@@ -2,7 +2,12 @@ from sqlmodel import Session, create_engine
 
 from app.config import settings
 
-engine = create_engine(settings.database_url)
+connect_args = {}
+if settings.database_url.startswith("sqlite"):
+    # Sessions are used from the threadpool and from job worker threads.
+    connect_args["check_same_thread"] = False
+
+engine = create_engine(settings.database_url, connect_args=connect_args)
 
 
 def get_session():
@@ -0,0 +1,371 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.database import engine
+from app.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+
+# Responses of these paths carry credentials and are never stored.
+EXCLUDED_PATHS = {"/token"}
+
+
+class StoredResponse:
+    def __init__(self, status_code: int, headers: List[List[str]], body: bytes) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+
+class IdempotencyMismatch(Exception):
+    pass
+
+
+class IdempotencyInFlight(Exception):
+    pass
+
+
+class _MemoryRecord:
+    def __init__(self, fingerprint: str, owner: str, expires_at: float) -> None:
+        self.fingerprint = fingerprint
+        self.owner = owner
+        self.expires_at = expires_at
+        self.response: Optional[StoredResponse] = None
+        self.done = asyncio.Event()
+
+
+class MemoryIdempotencyStore:
+    def __init__(
+        self,
+        max_keys: int = settings.idempotency_max_keys,
+        ttl: int = settings.idempotency_ttl,
+        wait_timeout: float = settings.idempotency_wait_timeout,
+    ) -> None:
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._in_flight: Dict[str, _MemoryRecord] = {}
+        self._records: "OrderedDict[str, _MemoryRecord]" = OrderedDict()
+
+    async def begin(
+        self, key: str, fingerprint: str, owner: str
+    ) -> Optional[StoredResponse]:
+        while True:
+            record = self._in_flight.get(key)
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    raise IdempotencyMismatch()
+                try:
+                    await asyncio.wait_for(record.done.wait(), self.wait_timeout)
+                except asyncio.TimeoutError:
+                    raise IdempotencyInFlight()
+                # Either completed or released by the first request, look again.
+                continue
+
+            record = self._records.get(key)
+            if record is not None and record.expires_at < time.monotonic():
+                del self._records[key]
+                record = None
+            if record is not None:
+                self._records.move_to_end(key)
+                if record.fingerprint != fingerprint:
+                    raise IdempotencyMismatch()
+                return record.response
+
+            self._in_flight[key] = _MemoryRecord(
+                fingerprint, owner, time.monotonic() + self.ttl
+            )
+            return None
+
+    async def keep_alive(self, key: str, owner: str) -> None:
+        # In-flight records live until released, nothing to renew.
+        pass
+
+    async def complete(self, key: str, owner: str, response: StoredResponse) -> None:
+        record = self._pop_in_flight(key, owner)
+        if record is None:
+            return
+        record.response = response
+        record.expires_at = time.monotonic() + self.ttl
+        self._records[key] = record
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+        record.done.set()
+
+    async def release(self, key: str, owner: str) -> None:
+        record = self._pop_in_flight(key, owner)
+        if record is not None:
+            record.done.set()
+
+    def _pop_in_flight(self, key: str, owner: str) -> Optional[_MemoryRecord]:
+        record = self._in_flight.get(key)
+        if record is None or record.owner != owner:
+            return None
+        return self._in_flight.pop(key)
+
+
+class DatabaseIdempotencyStore:
+    poll_interval = 0.1
+    purge_interval = 60.0
+
+    def __init__(
+        self,
+        ttl: int = settings.idempotency_ttl,
+        wait_timeout: float = settings.idempotency_wait_timeout,
+    ) -> None:
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._last_purge = 0.0
+
+    async def begin(
+        self, key: str, fingerprint: str, owner: str
+    ) -> Optional[StoredResponse]:
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            acquired, record = await run_in_threadpool(
+                self._reserve, key, fingerprint, owner
+            )
+            if acquired:
+                return None
+            if record.fingerprint != fingerprint:
+                raise IdempotencyMismatch()
+            if record.status_code is not None:
+                return StoredResponse(record.status_code, record.headers, record.body)
+            if time.monotonic() > deadline:
+                raise IdempotencyInFlight()
+            await asyncio.sleep(self.poll_interval)
+
+    async def keep_alive(self, key: str, owner: str) -> None:
+        while True:
+            await asyncio.sleep(self.wait_timeout / 3)
+            try:
+                await run_in_threadpool(self._renew, key, owner)
+            except Exception:
+                logger.exception("Could not renew idempotency key lease")
+
+    async def complete(self, key: str, owner: str, response: StoredResponse) -> None:
+        await run_in_threadpool(self._complete, key, owner, response)
+
+    async def release(self, key: str, owner: str) -> None:
+        await run_in_threadpool(self._release, key, owner)
+
+    def _reserve(
+        self, key: str, fingerprint: str, owner: str
+    ) -> Tuple[bool, Optional[IdempotencyKey]]:
+        # In-flight rows only hold a short lease, renewed while the request
+        # runs, so a key reserved by a process that died is taken over once
+        # it expires instead of answering 409 until the full TTL has passed.
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            if time.monotonic() - self._last_purge > self.purge_interval:
+                self._last_purge = time.monotonic()
+                session.execute(
+                    delete(IdempotencyKey).where(IdempotencyKey.expires_at < now)
+                )
+            else:
+                session.execute(
+                    delete(IdempotencyKey).where(
+                        IdempotencyKey.key == key, IdempotencyKey.expires_at < now
+                    )
+                )
+            session.add(
+                IdempotencyKey(
+                    key=key,
+                    fingerprint=fingerprint,
+                    owner=owner,
+                    expires_at=now + timedelta(seconds=self.wait_timeout),
+                )
+            )
+            try:
+                session.commit()
+                return True, None
+            except IntegrityError:
+                session.rollback()
+
+            query = select(IdempotencyKey).where(IdempotencyKey.key == key)
+            record = session.execute(query).scalar_one_or_none()
+            if record is None:
+                # Released between the insert and the select, try again.
+                return self._reserve(key, fingerprint, owner)
+            return False, record
+
+    def _renew(self, key: str, owner: str) -> None:
+        with Session(engine) as session:
+            session.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.owner == owner,
+                    IdempotencyKey.status_code.is_(None),
+                )
+                .values(
+                    expires_at=datetime.utcnow() + timedelta(seconds=self.wait_timeout)
+                )
+            )
+            session.commit()
+
+    def _complete(self, key: str, owner: str, response: StoredResponse) -> None:
+        # A request whose reservation was taken over leaves the key to the
+        # request that now holds it.
+        with Session(engine) as session:
+            query = select(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.owner == owner,
+                IdempotencyKey.status_code.is_(None),
+            )
+            record = session.execute(query).scalar_one_or_none()
+            if record is None:
+                return
+            record.status_code = response.status_code
+            record.headers = response.headers
+            record.body = response.body
+            record.expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+            session.commit()
+
+    def _release(self, key: str, owner: str) -> None:
+        with Session(engine) as session:
+            session.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.owner == owner,
+                    IdempotencyKey.status_code.is_(None),
+                )
+            )
+            session.commit()
+
+
+def get_idempotency_store():
+    if settings.idempotency_backend == "database":
+        return DatabaseIdempotencyStore()
+    return MemoryIdempotencyStore()
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp, store=None) -> None:
+        self.app = app
+        self.store = store if store is not None else get_idempotency_store()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] in EXCLUDED_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        body = hashlib.sha256()
+        while True:
+            message = await receive()
+            messages.append(message)
+            body.update(message.get("body", b""))
+            if message["type"] != "http.request" or not message.get("more_body"):
+                break
+
+        # Keys are scoped to the caller, the payload must match to be replayed.
+        key = hashlib.sha256(
+            headers.get(b"authorization", b"") + b"\0" + idempotency_key
+        ).hexdigest()
+        fingerprint = hashlib.sha256(
+            scope["path"].encode()
+            + b"\0"
+            + scope.get("query_string", b"")
+            + b"\0"
+            + body.digest()
+        ).hexdigest()
+
+        try:
+            owner = uuid4().hex
+            stored = await self.store.begin(key, fingerprint, owner)
+        except IdempotencyMismatch:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key already used with a different request"},
+                status_code=422,
+            )
+            await response(scope, receive, send)
+            return
+        except IdempotencyInFlight:
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"},
+                status_code=409,
+            )
+            await response(scope, receive, send)
+            return
+
+        if stored is not None:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": stored.status_code,
+                    "headers": [
+                        (name.encode("latin-1"), value.encode("latin-1"))
+                        for name, value in stored.headers
+                    ]
+                    + [(REPLAYED_HEADER, b"true")],
+                }
+            )
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        async def replay_receive() -> Message:
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        status_code = 500
+        response_headers: List[List[str]] = []
+        response_body = bytearray()
+
+        async def capture_send(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers.extend(
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                )
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        keep_alive = asyncio.ensure_future(self.store.keep_alive(key, owner))
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await self.store.release(key, owner)
+            raise
+        finally:
+            keep_alive.cancel()
+
+        # Server errors are not cached so that the client can retry them.
+        if status_code >= 500:
+            await self.store.release(key, owner)
+        else:
+            await self.store.complete(
+                key,
+                owner,
+                StoredResponse(status_code, response_headers, bytes(response_body)),
+            )
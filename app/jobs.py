@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import func, select, update
+from sqlmodel import Session
+
+from app.config import settings
+from app.database import engine
+from app.models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobType:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Dict[str, Any]], Any],
+        concurrency: int,
+        max_attempts: int,
+        backoff: float,
+        on_failure: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_failure = on_failure
+
+    def retry_delay(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.backoff * 2 ** (attempts - 1), 3600))
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    job_type: str
+    payload: Dict[str, Any]
+
+
+job_types: Dict[str, JobType] = {}
+
+
+def job(
+    name: str,
+    concurrency: int = 1,
+    max_attempts: int = 5,
+    backoff: float = 5.0,
+    on_failure: Optional[Callable[[Dict[str, Any]], Any]] = None,
+):
+    # on_failure runs once a job is failed for good, to release what its
+    # payload points to.
+    def decorator(handler: Callable[[Dict[str, Any]], Any]):
+        job_types[name] = JobType(
+            name, handler, concurrency, max_attempts, backoff, on_failure
+        )
+        return handler
+
+    return decorator
+
+
+def insert_job(
+    job_type: str,
+    payload: Dict[str, Any],
+    session: Session,
+    run_at: Optional[datetime] = None,
+) -> Job:
+    job_db = Job(
+        job_type=job_type,
+        payload=payload,
+        max_attempts=job_types[job_type].max_attempts,
+        run_at=run_at or datetime.utcnow(),
+    )
+    session.add(job_db)
+    session.commit()
+
+    return job_db
+
+
+def select_job_by_id(job_id: int, session: Session) -> Job:
+    query = select(Job).where(Job.id == job_id)
+    return session.execute(query).scalar_one()
+
+
+def select_queue_depth(session: Session) -> Dict[str, Dict[str, int]]:
+    query = (
+        select(Job.job_type, Job.status, func.count())
+        .where(Job.status.in_([JobStatus.pending, JobStatus.running]))
+        .group_by(Job.job_type, Job.status)
+    )
+    depth: Dict[str, Dict[str, int]] = {}
+    for job_type, status, count in session.execute(query):
+        depth.setdefault(job_type, {JobStatus.pending: 0, JobStatus.running: 0})
+        depth[job_type][status] = count
+    return depth
+
+
+def claim_jobs(
+    job_type: str, limit: int, worker_id: str, session: Session
+) -> List[ClaimedJob]:
+    # FOR UPDATE SKIP LOCKED lets concurrent workers on Postgres skip each
+    # other's candidates; SQLite drops the clause and relies on the guarded
+    # UPDATE below, which only one writer can win.
+    now = datetime.utcnow()
+    query = (
+        select(Job.id, Job.job_type, Job.payload)
+        .where(
+            Job.job_type == job_type,
+            Job.status == JobStatus.pending,
+            Job.run_at <= now,
+        )
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = []
+    for job_id, job_type, payload in session.execute(query).all():
+        result = session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.pending)
+            .values(
+                status=JobStatus.running,
+                attempts=Job.attempts + 1,
+                locked_by=worker_id,
+                updated_at=now,
+            )
+        )
+        if result.rowcount:
+            claimed.append(ClaimedJob(job_id, job_type, payload))
+    session.commit()
+
+    return claimed
+
+
+def renew_job_lease(job_id: int, worker_id: str, session: Session) -> bool:
+    result = session.execute(
+        update(Job)
+        .where(
+            Job.id == job_id,
+            Job.status == JobStatus.running,
+            Job.locked_by == worker_id,
+        )
+        .values(updated_at=datetime.utcnow())
+    )
+    session.commit()
+
+    return bool(result.rowcount)
+
+
+def fail_stale_jobs(session: Session) -> List[ClaimedJob]:
+    # Jobs whose lease was not renewed belong to a worker that died. Those
+    # that used all their attempts are failed, the rest are requeued below.
+    now = datetime.utcnow()
+    deadline = now - timedelta(seconds=settings.jobs_lock_timeout)
+    stale = (
+        Job.status == JobStatus.running,
+        Job.updated_at < deadline,
+        Job.attempts >= Job.max_attempts,
+    )
+    query = select(Job.id, Job.job_type, Job.payload).where(*stale)
+    failed = []
+    for job_id, job_type, payload in session.execute(query).all():
+        result = session.execute(
+            update(Job)
+            .where(Job.id == job_id, *stale)
+            .values(
+                status=JobStatus.failed,
+                last_error="Job lease expired",
+                locked_by=None,
+                updated_at=now,
+            )
+        )
+        if result.rowcount:
+            failed.append(ClaimedJob(job_id, job_type, payload))
+    session.commit()
+
+    return failed
+
+
+def requeue_stale_jobs(session: Session) -> int:
+    now = datetime.utcnow()
+    deadline = now - timedelta(seconds=settings.jobs_lock_timeout)
+    result = session.execute(
+        update(Job)
+        .where(
+            Job.status == JobStatus.running,
+            Job.updated_at < deadline,
+            Job.attempts < Job.max_attempts,
+        )
+        .values(status=JobStatus.pending, locked_by=None, updated_at=now)
+    )
+    session.commit()
+
+    return result.rowcount
+
+
+def complete_job(job_id: int, worker_id: str, session: Session) -> None:
+    # A worker that lost its lease leaves the job to its new owner.
+    session.execute(
+        update(Job)
+        .where(
+            Job.id == job_id,
+            Job.status == JobStatus.running,
+            Job.locked_by == worker_id,
+        )
+        .values(
+            status=JobStatus.done,
+            last_error=None,
+            locked_by=None,
+            updated_at=datetime.utcnow(),
+        )
+    )
+    session.commit()
+
+
+def fail_job(job_id: int, worker_id: str, error: str, session: Session) -> bool:
+    job_db = select_job_by_id(job_id, session)
+    if job_db.status != JobStatus.running or job_db.locked_by != worker_id:
+        return False
+    job_db.last_error = error
+    job_db.locked_by = None
+    job_db.updated_at = datetime.utcnow()
+    job_type = job_types.get(job_db.job_type)
+    if job_type is not None and job_db.attempts < job_db.max_attempts:
+        job_db.status = JobStatus.pending
+        job_db.run_at = job_db.updated_at + job_type.retry_delay(job_db.attempts)
+    else:
+        job_db.status = JobStatus.failed
+    session.commit()
+
+    return job_db.status == JobStatus.failed
+
+
+class Worker:
+    def __init__(
+        self,
+        concurrency: int = settings.jobs_concurrency,
+        poll_interval: float = settings.jobs_poll_interval,
+    ) -> None:
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[str, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._stopping is not None:
+            self._stopping.set()
+            self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        logger.info("Job worker %s started", self.worker_id)
+
+        while not self._stopping.is_set():
+            claimed = []
+            try:
+                free = self.concurrency - len(self._tasks)
+                limits = self._available_slots(free)
+                if limits:
+                    claimed = await loop.run_in_executor(
+                        None, self._claim, limits, free
+                    )
+                for job in claimed:
+                    self._running[job.job_type] = self._running.get(job.job_type, 0) + 1
+                    task = asyncio.ensure_future(self._execute(job))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except Exception:
+                logger.exception("Could not claim jobs")
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("Job worker %s stopped", self.worker_id)
+
+    def _available_slots(self, free: int) -> Dict[str, int]:
+        limits = {}
+        for name, job_type in job_types.items():
+            available = min(free, job_type.concurrency - self._running.get(name, 0))
+            if available > 0:
+                limits[name] = available
+        return limits
+
+    def _claim(self, limits: Dict[str, int], free: int) -> List[ClaimedJob]:
+        claimed: List[ClaimedJob] = []
+        with Session(engine) as session:
+            failed = fail_stale_jobs(session)
+            requeue_stale_jobs(session)
+            for name, limit in limits.items():
+                limit = min(limit, free - len(claimed))
+                if limit <= 0:
+                    break
+                claimed += claim_jobs(name, limit, self.worker_id, session)
+        for job in failed:
+            self._on_failure(job)
+        return claimed
+
+    async def _execute(self, job: ClaimedJob) -> None:
+        loop = asyncio.get_running_loop()
+        handler = job_types[job.job_type].handler
+        heartbeat = asyncio.ensure_future(self._renew_lease(job.id))
+        error = None
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                await handler(job.payload)
+            else:
+                await loop.run_in_executor(None, handler, job.payload)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.job_type)
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            heartbeat.cancel()
+        try:
+            await loop.run_in_executor(None, self._finish, job, error)
+        except Exception:
+            logger.exception("Could not record result of job %s", job.id)
+        finally:
+            self._running[job.job_type] -= 1
+            self._wakeup.set()
+
+    async def _renew_lease(self, job_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.jobs_lock_timeout / 3)
+            try:
+                await loop.run_in_executor(None, self._renew, job_id)
+            except Exception:
+                logger.exception("Could not renew the lease of job %s", job_id)
+
+    def _renew(self, job_id: int) -> None:
+        with Session(engine) as session:
+            if not renew_job_lease(job_id, self.worker_id, session):
+                logger.warning("Job %s lease was lost", job_id)
+
+    def _finish(self, job: ClaimedJob, error: Optional[str]) -> None:
+        with Session(engine) as session:
+            if error is None:
+                complete_job(job.id, self.worker_id, session)
+            elif fail_job(job.id, self.worker_id, error, session):
+                self._on_failure(job)
+
+    def _on_failure(self, job: ClaimedJob) -> None:
+        job_type = job_types.get(job.job_type)
+        if job_type is None or job_type.on_failure is None:
+            return
+        try:
+            job_type.on_failure(job.payload)
+        except Exception:
+            logger.exception("Failure hook of job %s (%s) failed", job.id, job.job_type)
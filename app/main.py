@@ -2,10 +2,15 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
 
+from app import tasks  # noqa: F401  registers the job handlers
 from app.api import router
+from app.broadcast import broadcaster
 from app.config import settings
+from app.idempotency import IdempotencyMiddleware
+from app.jobs import Worker
 
 app = FastAPI()
+app.add_middleware(IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,3 +21,26 @@ app.add_middleware(
 app.mount("/storage", StaticFiles(directory=settings.storage_dir), name="storage")
 
 app.include_router(router=router, prefix="")
+
+worker = Worker()
+
+
+@app.on_event("startup")
+async def start_worker():
+    if settings.jobs_in_process:
+        worker.start()
+
+
+@app.on_event("startup")
+async def start_broadcaster():
+    await broadcaster.start()
+
+
+@app.on_event("shutdown")
+async def stop_worker():
+    await worker.stop()
+
+
+@app.on_event("shutdown")
+async def stop_broadcaster():
+    await broadcaster.stop()
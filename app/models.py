@@ -1,7 +1,7 @@
 from datetime import datetime as dt
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import JSON, Column, DateTime, Index, LargeBinary, UniqueConstraint
 from sqlmodel import Field, Relationship, SQLModel, DateTime, Text
 
 
@@ -90,6 +90,10 @@ class PasswordChange(SQLModel):
 
 class RewardUserLink(SQLModel, table=True):
     __tablename__ = "winned_rewards"
+    __table_args__ = (
+        UniqueConstraint("reward_id", name="uq_winned_rewards_reward_id"),
+        Index("ix_winned_rewards_user_id", "user_id"),
+    )
 
     id: int = Field(primary_key=True, nullable=False, default=None)
     #raffle_id: int = Field(primary_key=True, foreign_key="raffles.id")
@@ -99,15 +103,30 @@ class RewardUserLink(SQLModel, table=True):
 
 class RaffleRewards(SQLModel, table=True):
     __tablename__ = "raffles_rewards"
+    __table_args__ = (
+        UniqueConstraint("id", name="uq_raffles_rewards_id"),
+        UniqueConstraint("raffle_id", "name", name="uq_raffles_rewards_raffle_id_name"),
+    )
 
     raffle_id: int = Field(primary_key=True, foreign_key="raffles.id")
     id: int = Field(primary_key=True, default=None, nullable=False)
-    name: str = Field(max_length=32, unique=True, index=True)
+    name: str = Field(max_length=32)
     
     raffles: List["Raffle"] = Relationship(back_populates="rewards")
 
 class RaffleUserLink(SQLModel, table=True):
     __tablename__ = "raffles_numbers"
+    __table_args__ = (
+        UniqueConstraint(
+            "raffle_id", "buyed_number", name="uq_raffles_numbers_raffle_id_buyed_number"
+        ),
+        Index(
+            "ix_raffles_numbers_user_id_raffle_id",
+            "user_id",
+            "raffle_id",
+            postgresql_include=["buyed_number", "price"],
+        ),
+    )
 
     id: int = Field(default=None, primary_key=True, nullable=False)
     price: int = Field(default=0)
@@ -128,23 +147,121 @@ class Raffle(RaffleBase, table=True):
 
     id: int = Field(default=None, primary_key=True, nullable=False)
     state: bool = Field(default=True)
+    archived: bool = Field(default=False)
 
     rewards: List["RaffleRewards"] = Relationship(back_populates="raffles")
     user: List["User"] = Relationship(back_populates="raffles")
    
-    created_by: int = Field(foreign_key="users.id")
+    created_by: int = Field(foreign_key="users.id", index=True)
     #creator: "User" = Relationship(back_populates="raffles_created")
 
 
+# Archive tables hold the rows of closed raffles, moved out of the live tables
+# so that they stay small. Rows keep their original ids.
+class RaffleUserLinkArchive(SQLModel, table=True):
+    __tablename__ = "raffles_numbers_archive"
+    __table_args__ = (
+        Index(
+            "ix_raffles_numbers_archive_user_id_raffle_id",
+            "user_id",
+            "raffle_id",
+            postgresql_include=["buyed_number", "price"],
+        ),
+        Index("ix_raffles_numbers_archive_raffle_id", "raffle_id"),
+    )
+
+    id: int = Field(primary_key=True, nullable=False)
+    price: int
+    buyed_number: int
+    raffle_id: int
+    user_id: int
+
+
+class RaffleRewardsArchive(SQLModel, table=True):
+    __tablename__ = "raffles_rewards_archive"
+
+    id: int = Field(primary_key=True, nullable=False)
+    raffle_id: int = Field(index=True)
+    name: str = Field(max_length=32)
+
+
+class RewardUserLinkArchive(SQLModel, table=True):
+    __tablename__ = "winned_rewards_archive"
+
+    id: int = Field(primary_key=True, nullable=False)
+    reward_id: int = Field(index=True)
+    user_id: int = Field(index=True)
+
+
 class RaffleCreate(RaffleBase):
     rewards: List[str] = []
 
 
+class RaffleRewardRead(SQLModel):
+    id: int
+    name: str
+
+
 class UserRaffles(RaffleBase):
-    pass
+    id: int
+    state: bool
+    numbers_bought: List[int]
+    total_spent: int
+    winned_rewards: List[RaffleRewardRead]
+
+
+class UserRafflesPage(SQLModel):
+    items: List[UserRaffles]
+    next_cursor: Optional[int]
 
 #class RaffleRead(RaffleBase):
 #    id: int
 
 
+class JobStatus:
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class Job(SQLModel, table=True):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_type_run_at", "status", "job_type", "run_at"),)
+
+    id: int = Field(primary_key=True, default=None)
+    job_type: str = Field(max_length=64)
+    payload: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    status: str = Field(max_length=16, default=JobStatus.pending)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
+    locked_by: Optional[str] = Field(max_length=128, nullable=True)
+    run_at: dt = Field(default_factory=dt.utcnow)
+    created_at: dt = Field(default_factory=dt.utcnow)
+    updated_at: dt = Field(default_factory=dt.utcnow)
+
+
+class JobRead(SQLModel):
+    id: int
+    job_type: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    created_at: dt
+    updated_at: dt
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __tablename__ = "idempotency_keys"
+
+    key: str = Field(primary_key=True, max_length=64)
+    fingerprint: str = Field(max_length=64)
+    owner: Optional[str] = Field(default=None, max_length=32, nullable=True)
+    status_code: Optional[int] = Field(default=None, nullable=True)
+    headers: List[List[str]] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+    body: bytes = Field(default=b"", sa_column=Column(LargeBinary, nullable=False))
+    expires_at: dt = Field(index=True)
+
+
 UserRead.update_forward_refs()
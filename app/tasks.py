@@ -0,0 +1,32 @@
+from typing import Any, Dict
+
+from sqlmodel import Session
+
+from app.archive import archive_raffle
+from app.crud import update_user
+from app.database import engine
+from app.jobs import job
+from app.models import UserUpdate
+from app.utilities import discard_staged_upload, save_user_image
+
+
+def discard_user_image(payload: Dict[str, Any]) -> None:
+    discard_staged_upload(payload["staged_path"])
+
+
+@job("store_user_image", concurrency=2, on_failure=discard_user_image)
+def store_user_image(payload: Dict[str, Any]) -> None:
+    image_path = save_user_image(
+        payload["user_id"], payload["staged_path"], payload["filename"]
+    )
+    with Session(engine) as session:
+        update_user(
+            payload["user_id"], UserUpdate(image_path=f"/{image_path}"), session
+        )
+    discard_staged_upload(payload["staged_path"])
+
+
+@job("archive_raffle", concurrency=1)
+def archive_raffle_job(payload: Dict[str, Any]) -> None:
+    with Session(engine) as session:
+        archive_raffle(payload["raffle_id"], session)
@@ -1,15 +1,38 @@
+import shutil
 from pathlib import Path
+from uuid import uuid4
 
 from fastapi import UploadFile
 
 from app.config import settings
 
 
-def save_user_image(user_id: int, image: UploadFile) -> str:
+def stage_upload(upload: UploadFile) -> str:
+    # Kept out of storage_dir, which is served publicly under /storage.
+    staging_path = Path(settings.staging_dir)
+    staging_path.mkdir(parents=True, exist_ok=True)
+
+    staged_file = staging_path / uuid4().hex
+    with open(staged_file, "wb") as f:
+        shutil.copyfileobj(upload.file, f)
+
+    return str(staged_file)
+
+
+def save_user_image(user_id: int, staged_path: str, filename: str) -> str:
     storage_path = Path(settings.storage_dir) / "user_images" / str(user_id)
     storage_path.mkdir(parents=True, exist_ok=True)
 
-    with open(storage_path / image.filename, "wb") as f:
-        f.write(image.file.read())
+    # The staged file is only discarded once the job succeeded, a retry copies
+    # it again or finds the copy left by an attempt that got this far.
+    image_path = storage_path / Path(filename).name
+    if Path(staged_path).exists():
+        shutil.copyfile(staged_path, image_path)
+    elif not image_path.exists():
+        raise FileNotFoundError(staged_path)
+
+    return str(image_path)
+
 
-    return str(storage_path / image.filename)
+def discard_staged_upload(staged_path: str) -> None:
+    Path(staged_path).unlink(missing_ok=True)
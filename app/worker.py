@@ -0,0 +1,19 @@
+import asyncio
+import logging
+import signal
+
+from app import tasks  # noqa: F401  registers the job handlers
+from app.jobs import Worker
+
+
+async def main() -> None:
+    worker = Worker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(worker.stop()))
+    await worker.start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
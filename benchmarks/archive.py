@@ -0,0 +1,156 @@
+import argparse
+import os
+import tempfile
+import time
+from itertools import count
+from typing import List
+
+from sqlalchemy import insert, select
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.archive import archive_raffle
+from app.crud import select_raffle_by_id
+from app.models import Raffle, RaffleUserLink, User
+
+TICKETS_PER_RAFFLE = 1000
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class History:
+    def __init__(self, engine, archive: bool) -> None:
+        self.engine = engine
+        self.archive = archive
+        self.raffle_ids = count(1)
+        self.ticket_ids = count(1)
+        self.tickets = 0
+
+    def add_closed_raffles(self, raffles: int) -> None:
+        raffle_ids = [next(self.raffle_ids) for _ in range(raffles)]
+        with self.engine.begin() as connection:
+            connection.execute(
+                insert(Raffle.__table__),
+                [
+                    {
+                        "id": raffle_id,
+                        "title": f"raffle-{raffle_id}",
+                        "details": "",
+                        "numbers": TICKETS_PER_RAFFLE,
+                        "state": False,
+                        "archived": False,
+                        "created_by": 1,
+                    }
+                    for raffle_id in raffle_ids
+                ],
+            )
+            connection.execute(
+                insert(RaffleUserLink.__table__),
+                [
+                    {
+                        "id": next(self.ticket_ids),
+                        "raffle_id": raffle_id,
+                        "user_id": 1,
+                        "buyed_number": number,
+                        "price": 1000,
+                    }
+                    for raffle_id in raffle_ids
+                    for number in range(TICKETS_PER_RAFFLE)
+                ],
+            )
+        self.tickets += raffles * TICKETS_PER_RAFFLE
+
+        if self.archive:
+            with Session(self.engine) as session:
+                for raffle_id in raffle_ids:
+                    archive_raffle(raffle_id, session, batch_size=5000)
+
+    def measure_purchases(self, purchases: int) -> List[float]:
+        raffle_id = next(self.raffle_ids)
+        with Session(self.engine) as session:
+            session.add(
+                Raffle(
+                    id=raffle_id,
+                    title=f"raffle-{raffle_id}",
+                    details="",
+                    numbers=purchases,
+                    created_by=1,
+                )
+            )
+            session.commit()
+
+            # A purchase checks that the number is still free on the
+            # (raffle_id, buyed_number) index and stores the ticket.
+            latencies = []
+            for number in range(purchases):
+                start = time.perf_counter()
+                query = select(RaffleUserLink.id).where(
+                    RaffleUserLink.raffle_id == raffle_id,
+                    RaffleUserLink.buyed_number == number,
+                )
+                if session.execute(query).first() is None:
+                    session.add(
+                        RaffleUserLink(
+                            id=next(self.ticket_ids),
+                            raffle_id=raffle_id,
+                            user_id=1,
+                            buyed_number=number,
+                            price=1000,
+                        )
+                    )
+                    session.commit()
+                latencies.append(time.perf_counter() - start)
+
+            raffle = select_raffle_by_id(raffle_id, session)
+            raffle.state = False
+            session.commit()
+            self.tickets += purchases
+            if self.archive:
+                archive_raffle(raffle_id, session, batch_size=5000)
+        return latencies
+
+
+def create_database(path: str):
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username="buyer", fullname="Buyer"))
+        session.commit()
+    return engine
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Purchase latency as raffle history grows, with and without archival"
+    )
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--raffles-per-step", type=int, default=200)
+    parser.add_argument("--purchases", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        histories = {
+            "hot": History(create_database(os.path.join(directory, "hot.db")), False),
+            "archived": History(
+                create_database(os.path.join(directory, "archived.db")), True
+            ),
+        }
+        # Both modes answer a purchase from B-tree lookups, at these sizes the
+        # gap is within noise. It only opens once the live indexes no longer
+        # fit in cache, which this SQLite setup does not reproduce.
+        print(f"{'history tickets':>16} {'mode':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for _ in range(args.steps):
+            for mode, history in histories.items():
+                history.add_closed_raffles(args.raffles_per_step)
+                latencies = history.measure_purchases(args.purchases)
+                print(
+                    f"{history.tickets:>16} {mode:>9}"
+                    f" {percentile(latencies, 0.5) * 1000:>8.3f}"
+                    f" {percentile(latencies, 0.99) * 1000:>8.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import resource
+import time
+from typing import Dict, List, Tuple
+
+from app.broadcast import Broadcaster, LocalBackend, raffle_channel, stream_events
+
+
+class TimedBroadcaster(Broadcaster):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.flush_times: List[float] = []
+
+    def flush(self) -> None:
+        start = time.perf_counter()
+        super().flush()
+        self.flush_times.append(time.perf_counter() - start)
+
+
+async def consume(
+    broadcaster: Broadcaster,
+    channel: str,
+    ready: asyncio.Event,
+    receipts: List[Tuple[bytes, float]],
+) -> None:
+    # Reads the same generator the SSE endpoint streams, only the socket write
+    # is left out.
+    async for chunk in stream_events(channel, source=broadcaster):
+        if chunk.startswith(b"retry:"):
+            ready.set()
+        elif chunk.startswith(b"event:"):
+            receipts.append((chunk, time.perf_counter()))
+
+
+def publish_events(
+    loop: asyncio.AbstractEventLoop,
+    broadcaster: Broadcaster,
+    raffles: int,
+    events_per_second: int,
+    duration: float,
+    sent: Dict[int, float],
+) -> Tuple[List[concurrent.futures.Future], float]:
+    # Publishing runs on its own thread against a fixed schedule, so busy
+    # consumers on the event loop cannot slow down the offered rate.
+    futures = []
+    start = time.perf_counter()
+    while len(sent) < events_per_second * duration:
+        number = len(sent)
+        delay = start + number / events_per_second - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent[number] = time.perf_counter()
+        futures.append(
+            asyncio.run_coroutine_threadsafe(
+                broadcaster.publish(
+                    raffle_channel(number % raffles),
+                    {"type": "numbers_sold", "numbers": [number]},
+                ),
+                loop,
+            )
+        )
+    return futures, time.perf_counter() - start
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(
+    subscribers: int,
+    raffles: int,
+    events_per_second: int,
+    duration: float,
+    batch_interval: float,
+) -> None:
+    broadcaster = TimedBroadcaster(LocalBackend(), batch_interval=batch_interval)
+    await broadcaster.start()
+
+    receipts: List[Tuple[bytes, float]] = []
+    tasks = []
+    for i in range(subscribers):
+        ready = asyncio.Event()
+        channel = raffle_channel(i % raffles)
+        tasks.append(
+            asyncio.ensure_future(consume(broadcaster, channel, ready, receipts))
+        )
+        await ready.wait()
+    print(f"subscribers:          {broadcaster.subscriber_count()}")
+
+    sent: Dict[int, float] = {}
+    loop = asyncio.get_running_loop()
+    futures, elapsed = await loop.run_in_executor(
+        None,
+        publish_events,
+        loop,
+        broadcaster,
+        raffles,
+        events_per_second,
+        duration,
+        sent,
+    )
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+    await asyncio.sleep(batch_interval * 4)
+
+    remaining = broadcaster.subscriber_count()
+    await broadcaster.stop()
+    await asyncio.gather(*tasks)
+
+    # Latency is measured from the oldest event in each batch, so it includes
+    # the time spent waiting for the batch to be flushed.
+    oldest: Dict[int, float] = {}
+    latencies = []
+    for chunk, received_at in receipts:
+        if id(chunk) not in oldest:
+            data = json.loads(chunk.split(b"data: ", 1)[1])
+            oldest[id(chunk)] = min(sent[number] for number in data["numbers"])
+        latencies.append(received_at - oldest[id(chunk)])
+
+    print("delivery is measured at the SSE generator, socket writes excluded")
+    print(
+        f"publish rate:         {len(sent) / elapsed:.0f}/s"
+        f" (target {events_per_second}/s)"
+    )
+    print(f"events published:     {len(sent)}")
+    print(f"batches encoded:      {len(oldest)}")
+    print(f"deliveries:           {len(receipts)}")
+    print(f"dropped consumers:    {subscribers - remaining}")
+    print(
+        f"flush p50 / p99:      {percentile(broadcaster.flush_times, 0.5) * 1000:.2f} ms"
+        f" / {percentile(broadcaster.flush_times, 0.99) * 1000:.2f} ms"
+    )
+    print(
+        f"delivery p50 / p99:   {percentile(latencies, 0.5) * 1000:.2f} ms"
+        f" / {percentile(latencies, 0.99) * 1000:.2f} ms"
+    )
+    print(
+        "max rss:              "
+        f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Raffle events fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--raffles", type=int, default=10)
+    parser.add_argument("--events-per-second", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--batch-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    asyncio.run(
+        run(
+            args.subscribers,
+            args.raffles,
+            args.events_per_second,
+            args.duration,
+            args.batch_interval,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
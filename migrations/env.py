@@ -5,7 +5,7 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 from sqlmodel import SQLModel
 
-from app.models import Role, User, UserRoleLink, RewardUserLink, RaffleRewards, RaffleUserLink, Raffle
+from app.models import IdempotencyKey, Job, Role, User, UserRoleLink, RewardUserLink, RewardUserLinkArchive, RaffleRewards, RaffleRewardsArchive, RaffleUserLink, RaffleUserLinkArchive, Raffle
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,76 @@
+"""raffle indexes
+
+Revision ID: 4c7e9b2a51f3
+Revises: 8f3a61c0d2b4
+Create Date: 2026-10-19 11:03:27.518934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '4c7e9b2a51f3'
+down_revision = '8f3a61c0d2b4'
+branch_labels = None
+depends_on = None
+
+
+# The raffle tables were added to the models without a migration, so they are
+# created here together with their constraints and indexes.
+def upgrade() -> None:
+    op.create_table('raffles',
+    sa.Column('title', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+    sa.Column('details', sqlmodel.sql.sqltypes.AutoString(length=256), nullable=False),
+    sa.Column('numbers', sa.Integer(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('state', sa.Boolean(), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_raffles_title'), 'raffles', ['title'], unique=True)
+    op.create_index(op.f('ix_raffles_created_by'), 'raffles', ['created_by'], unique=False)
+    op.create_table('raffles_rewards',
+    sa.Column('raffle_id', sa.Integer(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+    sa.ForeignKeyConstraint(['raffle_id'], ['raffles.id'], ),
+    sa.PrimaryKeyConstraint('raffle_id', 'id'),
+    sa.UniqueConstraint('id', name='uq_raffles_rewards_id'),
+    sa.UniqueConstraint('raffle_id', 'name', name='uq_raffles_rewards_raffle_id_name')
+    )
+    op.create_table('raffles_numbers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('buyed_number', sa.Integer(), nullable=False),
+    sa.Column('raffle_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['raffle_id'], ['raffles.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id', 'raffle_id', 'user_id'),
+    sa.UniqueConstraint('raffle_id', 'buyed_number', name='uq_raffles_numbers_raffle_id_buyed_number')
+    )
+    op.create_index('ix_raffles_numbers_user_id_raffle_id', 'raffles_numbers', ['user_id', 'raffle_id'], unique=False)
+    op.create_table('winned_rewards',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('reward_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['reward_id'], ['raffles_rewards.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id', 'reward_id', 'user_id'),
+    sa.UniqueConstraint('reward_id', name='uq_winned_rewards_reward_id')
+    )
+    op.create_index('ix_winned_rewards_user_id', 'winned_rewards', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_winned_rewards_user_id', table_name='winned_rewards')
+    op.drop_table('winned_rewards')
+    op.drop_index('ix_raffles_numbers_user_id_raffle_id', table_name='raffles_numbers')
+    op.drop_table('raffles_numbers')
+    op.drop_table('raffles_rewards')
+    op.drop_index(op.f('ix_raffles_created_by'), table_name='raffles')
+    op.drop_index(op.f('ix_raffles_title'), table_name='raffles')
+    op.drop_table('raffles')
@@ -0,0 +1,58 @@
+"""raffle archive
+
+Revision ID: 71f2c8a4d9e0
+Revises: e5a90d3b7c26
+Create Date: 2026-10-19 16:05:13.902771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '71f2c8a4d9e0'
+down_revision = 'e5a90d3b7c26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('raffles', sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.create_table('raffles_numbers_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('buyed_number', sa.Integer(), nullable=False),
+    sa.Column('raffle_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_raffles_numbers_archive_raffle_id', 'raffles_numbers_archive', ['raffle_id'], unique=False)
+    op.create_index('ix_raffles_numbers_archive_user_id_raffle_id', 'raffles_numbers_archive', ['user_id', 'raffle_id'], unique=False, postgresql_include=['buyed_number', 'price'])
+    op.create_table('raffles_rewards_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('raffle_id', sa.Integer(), nullable=False),
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_raffles_rewards_archive_raffle_id'), 'raffles_rewards_archive', ['raffle_id'], unique=False)
+    op.create_table('winned_rewards_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('reward_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_winned_rewards_archive_reward_id'), 'winned_rewards_archive', ['reward_id'], unique=False)
+    op.create_index(op.f('ix_winned_rewards_archive_user_id'), 'winned_rewards_archive', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_winned_rewards_archive_user_id'), table_name='winned_rewards_archive')
+    op.drop_index(op.f('ix_winned_rewards_archive_reward_id'), table_name='winned_rewards_archive')
+    op.drop_table('winned_rewards_archive')
+    op.drop_index(op.f('ix_raffles_rewards_archive_raffle_id'), table_name='raffles_rewards_archive')
+    op.drop_table('raffles_rewards_archive')
+    op.drop_index('ix_raffles_numbers_archive_user_id_raffle_id', table_name='raffles_numbers_archive')
+    op.drop_index('ix_raffles_numbers_archive_raffle_id', table_name='raffles_numbers_archive')
+    op.drop_table('raffles_numbers_archive')
+    op.drop_column('raffles', 'archived')
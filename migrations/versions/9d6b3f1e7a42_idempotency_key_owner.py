@@ -0,0 +1,25 @@
+"""idempotency key owner
+
+Revision ID: 9d6b3f1e7a42
+Revises: 71f2c8a4d9e0
+Create Date: 2026-10-19 21:37:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '9d6b3f1e7a42'
+down_revision = '71f2c8a4d9e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('idempotency_keys', sa.Column('owner', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('idempotency_keys', 'owner')
@@ -0,0 +1,27 @@
+"""covering user tickets index
+
+Revision ID: e5a90d3b7c26
+Revises: b27d4e8f0c19
+Create Date: 2026-10-19 14:22:51.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a90d3b7c26'
+down_revision = 'b27d4e8f0c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index('ix_raffles_numbers_user_id_raffle_id', table_name='raffles_numbers')
+    op.create_index('ix_raffles_numbers_user_id_raffle_id', 'raffles_numbers', ['user_id', 'raffle_id'], unique=False, postgresql_include=['buyed_number', 'price'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_raffles_numbers_user_id_raffle_id', table_name='raffles_numbers')
+    op.create_index('ix_raffles_numbers_user_id_raffle_id', 'raffles_numbers', ['user_id', 'raffle_id'], unique=False)
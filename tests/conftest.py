@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+import pytest
+
+# Settings and the engine are created at import time, so the throwaway
+# database has to be configured before anything from app is imported. Set
+# TEST_DATABASE_URL to run against a dedicated Postgres database instead.
+directory = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = os.environ.get(
+    "TEST_DATABASE_URL", f"sqlite:///{os.path.join(directory, 'test.db')}"
+)
+os.environ["SECRET_KEY"] = "test"
+os.environ["STORAGE_DIR"] = os.path.join(directory, "storage")
+os.environ["STAGING_DIR"] = os.path.join(directory, "staging")
+os.makedirs(os.environ["STORAGE_DIR"])
+
+from sqlmodel import Session, SQLModel  # noqa: E402
+
+from app.database import engine  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def database():
+    SQLModel.metadata.create_all(engine)
+    yield
+    SQLModel.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def session():
+    with Session(engine) as session:
+        yield session
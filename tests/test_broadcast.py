@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import psycopg2
+from fastapi.testclient import TestClient
+
+from app import broadcast
+from app.api import get_raffle_events
+from app.main import app
+from app.models import Raffle, User
+
+
+class FakeConnection:
+    def __init__(self, fail: bool) -> None:
+        self.fail = fail
+        self.notifies = []
+        self.closed = False
+        self._read, self._write = os.pipe()
+
+    def fileno(self) -> int:
+        return self._read
+
+    def cursor(self) -> "FakeCursor":
+        return FakeCursor()
+
+    def poll(self) -> None:
+        os.read(self._read, 1024)
+        if self.fail:
+            raise psycopg2.OperationalError("server closed the connection")
+
+    def notify(self, channel: str, event) -> None:
+        payload = json.dumps({"channel": channel, "event": event})
+        self.notifies.append(SimpleNamespace(payload=payload))
+        os.write(self._write, b"x")
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, *args) -> None:
+        pass
+
+
+def test_postgres_backend_strips_the_driver_name():
+    backend = broadcast.PostgresBackend("postgresql+psycopg2://app:secret@db/raffles")
+    assert backend.dsn == "postgresql://app:secret@db/raffles"
+
+
+def test_postgres_listener_reconnects(monkeypatch):
+    connections = []
+
+    def connect(dsn):
+        connections.append(FakeConnection(fail=not connections))
+        return connections[-1]
+
+    monkeypatch.setattr(broadcast.psycopg2, "connect", connect)
+
+    async def main():
+        received = []
+        backend = broadcast.PostgresBackend("postgresql:///raffles")
+        await backend.start(lambda channel, event: received.append((channel, event)))
+        connections[0].notify("raffle:1", {"type": "lost"})
+        while len(connections) < 2:
+            await asyncio.sleep(0.05)
+        connections[1].notify("raffle:1", {"type": "draw"})
+        while not received:
+            await asyncio.sleep(0.05)
+        await backend.stop()
+        return received
+
+    received = asyncio.run(asyncio.wait_for(main(), 5))
+
+    assert received == [("raffle:1", {"type": "draw"})]
+    assert connections[0].closed and connections[1].closed
+
+
+def test_events_in_a_batch_are_coalesced():
+    async def main():
+        broadcaster = broadcast.Broadcaster(broadcast.LocalBackend())
+        await broadcaster.backend.start(broadcaster._on_message)
+        channel = broadcast.raffle_channel(1)
+        async with broadcaster.subscribe(channel) as subscription:
+            await broadcaster.publish(channel, {"type": "numbers_sold", "numbers": [7]})
+            await broadcaster.publish(channel, {"type": "draw", "results": []})
+            await broadcaster.publish(channel, {"type": "numbers_sold", "numbers": [3]})
+            await broadcaster.publish(
+                broadcast.raffle_channel(2), {"type": "draw", "results": []}
+            )
+            broadcaster.flush()
+            return subscription.queue.get_nowait(), subscription.queue.empty()
+
+    chunk, empty = asyncio.run(main())
+
+    # Numbers sold in the batch are merged and sent before the draw.
+    assert chunk == (
+        b'event: numbers_sold\ndata: {"type":"numbers_sold","numbers":[3,7]}\n\n'
+        b'event: draw\ndata: {"type":"draw","results":[]}\n\n'
+    )
+    assert empty
+
+
+def test_slow_subscriber_is_dropped():
+    async def main():
+        broadcaster = broadcast.Broadcaster(broadcast.LocalBackend(), queue_size=1)
+        await broadcaster.backend.start(broadcaster._on_message)
+        channel = broadcast.raffle_channel(1)
+        async with broadcaster.subscribe(channel) as slow:
+            async with broadcaster.subscribe(channel) as fast:
+                for number in range(2):
+                    event = {"type": "numbers_sold", "numbers": [number]}
+                    await broadcaster.publish(channel, event)
+                    broadcaster.flush()
+                    await fast.queue.get()
+                count = broadcaster.subscriber_count()
+            return slow, count
+
+    slow, count = asyncio.run(main())
+
+    assert slow.dropped
+    assert slow.queue.get_nowait() is None
+    assert count == 1
+
+
+def test_stream_ends_when_the_broadcaster_stops():
+    async def main():
+        broadcaster = broadcast.Broadcaster(
+            broadcast.LocalBackend(), batch_interval=0.01
+        )
+        await broadcaster.start()
+        channel = broadcast.raffle_channel(1)
+        chunks = []
+
+        async def read():
+            async for chunk in broadcast.stream_events(channel, source=broadcaster):
+                chunks.append(chunk)
+
+        reader = asyncio.ensure_future(read())
+        while not broadcaster.subscriber_count():
+            await asyncio.sleep(0.01)
+        await broadcaster.publish(channel, {"type": "draw", "results": []})
+        while len(chunks) < 2:
+            await asyncio.sleep(0.01)
+        await broadcaster.stop()
+        await asyncio.wait_for(reader, 1)
+        return chunks
+
+    chunks = asyncio.run(main())
+
+    assert chunks == [
+        b"retry: 3000\n\n",
+        b'event: draw\ndata: {"type":"draw","results":[]}\n\n',
+    ]
+
+
+def test_events_endpoint(session):
+    session.add(User(id=1, username="owner", fullname="Owner"))
+    session.add(Raffle(id=1, title="raffle", details="", numbers=10, created_by=1))
+    session.commit()
+
+    assert TestClient(app).get("/raffles/2/events").status_code == 404
+
+    # The stream never ends, so the handler is called directly.
+    response = asyncio.run(get_raffle_events(1))
+    assert response.media_type == "text/event-stream"
+    assert response.headers["cache-control"] == "no-cache"
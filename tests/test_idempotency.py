@@ -0,0 +1,177 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List
+
+import httpx
+import pytest
+from fastapi import FastAPI, Response
+from sqlalchemy import update
+
+from app.idempotency import (
+    DatabaseIdempotencyStore,
+    IdempotencyMiddleware,
+    MemoryIdempotencyStore,
+    StoredResponse,
+)
+from app.models import IdempotencyKey
+
+stores = {
+    "memory": MemoryIdempotencyStore,
+    "database": DatabaseIdempotencyStore,
+}
+
+
+def create_api(store, calls: List, delay: float = 0.0) -> FastAPI:
+    api = FastAPI()
+    api.add_middleware(IdempotencyMiddleware, store=store)
+
+    @api.post("/items")
+    async def create_item(page: int = 1):
+        calls.append(page)
+        await asyncio.sleep(delay)
+        return {"calls": len(calls)}
+
+    @api.post("/broken")
+    async def broken():
+        calls.append(None)
+        return Response(status_code=503)
+
+    @api.post("/token")
+    async def token():
+        calls.append(None)
+        return {"access_token": f"token-{len(calls)}"}
+
+    return api
+
+
+def post(api: FastAPI, *requests) -> List[httpx.Response]:
+    async def main():
+        async with httpx.AsyncClient(app=api, base_url="http://test") as client:
+            return await asyncio.gather(
+                *(
+                    client.post(path, headers={"Idempotency-Key": key})
+                    for path, key in requests
+                )
+            )
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("backend", stores)
+def test_concurrent_duplicates_run_once(backend):
+    calls = []
+    api = create_api(stores[backend](), calls, delay=0.3)
+
+    responses = post(api, *[("/items", "abc")] * 5)
+
+    assert calls == [1]
+    assert [response.json() for response in responses] == [{"calls": 1}] * 5
+    replayed = [r for r in responses if r.headers.get("idempotent-replayed")]
+    assert len(replayed) == 4
+
+
+@pytest.mark.parametrize("backend", stores)
+def test_query_string_is_part_of_the_fingerprint(backend):
+    api = create_api(stores[backend](), [])
+
+    [first] = post(api, ("/items?page=1", "abc"))
+    [replay] = post(api, ("/items?page=1", "abc"))
+    [other] = post(api, ("/items?page=2", "abc"))
+
+    assert replay.json() == first.json()
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert other.status_code == 422
+
+
+@pytest.mark.parametrize("backend", stores)
+def test_server_errors_release_the_key(backend):
+    calls = []
+    api = create_api(stores[backend](), calls)
+
+    responses = post(api, ("/broken", "abc")) + post(api, ("/broken", "abc"))
+
+    assert [response.status_code for response in responses] == [503, 503]
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("backend", stores)
+def test_waiting_duplicate_gives_up_with_409(backend):
+    calls = []
+    api = create_api(stores[backend](wait_timeout=0.2), calls, delay=1.0)
+
+    first, second = post(api, ("/items", "abc"), ("/items", "abc"))
+
+    assert sorted([first.status_code, second.status_code]) == [200, 409]
+    assert calls == [1]
+
+
+def test_token_responses_are_not_stored():
+    api = create_api(MemoryIdempotencyStore(), [])
+
+    first, second = post(api, ("/token", "abc")) + post(api, ("/token", "abc"))
+
+    assert first.json() != second.json()
+    assert "idempotent-replayed" not in second.headers
+
+
+def test_memory_store_evicts_least_recently_used_keys():
+    calls = []
+    api = create_api(MemoryIdempotencyStore(max_keys=2), calls)
+
+    post(api, ("/items", "a"))
+    post(api, ("/items", "b"))
+    post(api, ("/items", "a"))
+    post(api, ("/items", "c"))
+    [a, b] = post(api, ("/items", "a"), ("/items", "b"))
+
+    # b was the least recently used key when c was stored.
+    assert a.headers.get("idempotent-replayed") == "true"
+    assert "idempotent-replayed" not in b.headers
+    assert len(calls) == 4
+
+
+def test_database_lease_is_renewed_while_the_request_runs():
+    calls = []
+    store = DatabaseIdempotencyStore(wait_timeout=0.3)
+    api = create_api(store, calls, delay=1.2)
+
+    async def main():
+        async with httpx.AsyncClient(app=api, base_url="http://test") as client:
+            headers = {"Idempotency-Key": "abc"}
+            first = asyncio.ensure_future(client.post("/items", headers=headers))
+            # Retried well after the first lease would have expired.
+            await asyncio.sleep(0.6)
+            second = await client.post("/items", headers=headers)
+            return await first, second
+
+    first, second = asyncio.run(main())
+
+    assert calls == [1]
+    assert first.status_code == 200
+    assert second.status_code in (200, 409)
+
+
+def test_expired_reservation_is_taken_over(session):
+    store = DatabaseIdempotencyStore(ttl=3600, wait_timeout=0.2)
+    assert asyncio.run(store.begin("key", "fingerprint", "first")) is None
+    reservation = session.get(IdempotencyKey, "key")
+    assert reservation.expires_at < datetime.utcnow() + timedelta(seconds=1)
+
+    session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == "key")
+        .values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+    )
+    session.commit()
+    assert asyncio.run(store.begin("key", "fingerprint", "second")) is None
+
+    # The first owner lost the key, its result and release are ignored.
+    asyncio.run(store.complete("key", "first", StoredResponse(500, [], b"")))
+    asyncio.run(store.release("key", "first"))
+    asyncio.run(store.complete("key", "second", StoredResponse(201, [], b"{}")))
+
+    session.expire_all()
+    record = session.get(IdempotencyKey, "key")
+    assert record.owner == "second"
+    assert record.status_code == 201
+    assert record.expires_at > datetime.utcnow() + timedelta(seconds=3000)
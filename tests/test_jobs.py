@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import jobs
+from app.config import settings
+from app.models import Job, JobStatus
+
+
+def run_worker(until, timeout: float = 5.0) -> None:
+    async def main():
+        worker = jobs.Worker(concurrency=4, poll_interval=0.05)
+        worker.start()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not until() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        await worker.stop()
+
+    asyncio.run(main())
+
+
+def test_worker_runs_jobs_of_several_types(session, monkeypatch):
+    done = []
+    monkeypatch.setattr(jobs, "job_types", {})
+    jobs.job("first", concurrency=2)(lambda payload: done.append(payload["n"]))
+    jobs.job("second", concurrency=2)(lambda payload: done.append(payload["n"]))
+    ids = [
+        jobs.insert_job(name, {"n": n}, session).id
+        for n, name in enumerate(["first", "second", "first", "second"])
+    ]
+
+    run_worker(lambda: len(done) == 4)
+
+    session.expire_all()
+    assert sorted(done) == [0, 1, 2, 3]
+    for job_id in ids:
+        assert jobs.select_job_by_id(job_id, session).status == JobStatus.done
+
+
+def test_stale_jobs_are_requeued_until_attempts_run_out(session, monkeypatch):
+    monkeypatch.setattr(jobs, "job_types", {})
+    jobs.job("stale", max_attempts=2)(lambda payload: None)
+    retried = jobs.insert_job("stale", {}, session)
+    exhausted = jobs.insert_job("stale", {}, session)
+    stale_at = datetime.utcnow() - timedelta(seconds=settings.jobs_lock_timeout + 1)
+    for job_db, attempts in ((retried, 1), (exhausted, 2)):
+        session.execute(
+            update(Job)
+            .where(Job.id == job_db.id)
+            .values(
+                status=JobStatus.running,
+                attempts=attempts,
+                locked_by="dead",
+                updated_at=stale_at,
+            )
+        )
+    session.commit()
+
+    assert [job.id for job in jobs.fail_stale_jobs(session)] == [exhausted.id]
+    assert jobs.requeue_stale_jobs(session) == 1
+
+    session.expire_all()
+    assert jobs.select_job_by_id(retried.id, session).status == JobStatus.pending
+    assert jobs.select_job_by_id(exhausted.id, session).status == JobStatus.failed
+
+
+def test_results_from_a_lost_lease_are_ignored(session, monkeypatch):
+    monkeypatch.setattr(jobs, "job_types", {})
+    jobs.job("leased")(lambda payload: None)
+    jobs.insert_job("leased", {}, session)
+    [claimed] = jobs.claim_jobs("leased", 1, "owner", session)
+
+    assert not jobs.renew_job_lease(claimed.id, "other", session)
+    jobs.complete_job(claimed.id, "other", session)
+    jobs.fail_job(claimed.id, "other", "boom", session)
+
+    session.expire_all()
+    job_db = jobs.select_job_by_id(claimed.id, session)
+    assert job_db.status == JobStatus.running
+    assert job_db.locked_by == "owner"
+    assert jobs.renew_job_lease(claimed.id, "owner", session)
@@ -0,0 +1,322 @@
+import json
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+from sqlalchemy import event, insert
+from sqlmodel import Session, SQLModel
+
+from app import crud, jobs
+from app.database import engine
+from app.models import (
+    Job,
+    JobStatus,
+    Raffle,
+    RaffleRewards,
+    RaffleRewardsArchive,
+    RaffleUserLink,
+    RaffleUserLinkArchive,
+    RewardUserLink,
+    RewardUserLinkArchive,
+    Role,
+    User,
+)
+
+# Tables expected to grow with usage; a full read of any of them from a crud
+# query, directly or through a subquery, means an index is missing or the
+# query is not cut before it is sorted or grouped.
+LARGE_TABLES = {
+    "users",
+    "raffles",
+    "raffles_numbers",
+    "raffles_rewards",
+    "winned_rewards",
+    "raffles_numbers_archive",
+    "raffles_rewards_archive",
+    "winned_rewards_archive",
+    "jobs",
+}
+
+SEED_OFFSET = 10_000_000
+SEED_USERS = 2_000
+SEED_RAFFLES = 200
+SEED_NUMBERS_PER_RAFFLE = 100
+SEED_REWARDS_PER_RAFFLE = 3
+
+plan_checks: Dict[str, Callable[[Session], Any]] = {}
+
+
+def plan_check(name: str):
+    def decorator(check: Callable[[Session], Any]):
+        plan_checks[name] = check
+        return check
+
+    return decorator
+
+
+# Listing queries such as select_users and select_roles, and batch queries
+# such as select_archivable_raffle_ids, read whole tables by design and are not
+# checked.
+
+
+@plan_check("select_user_by_id")
+def _(session: Session):
+    crud.select_user_by_id(SEED_OFFSET + 1, session)
+
+
+@plan_check("select_user_by_username")
+def _(session: Session):
+    crud.select_user_by_username("plan-check-1", session)
+
+
+@plan_check("select_user_raffles")
+def _(session: Session):
+    crud.select_user_raffles(SEED_OFFSET + 1, session)
+    crud.select_user_raffles(SEED_OFFSET + 1, session, before=SEED_OFFSET + 100)
+
+
+@plan_check("select_role_by_id")
+def _(session: Session):
+    crud.select_role_by_id(SEED_OFFSET + 1, session)
+
+
+@plan_check("select_raffle_by_id")
+def _(session: Session):
+    crud.select_raffle_by_id(SEED_OFFSET + 1, session)
+
+
+@plan_check("select_raffle_numbers")
+def _(session: Session):
+    for raffle_id in (SEED_OFFSET + 1, SEED_OFFSET + SEED_RAFFLES):
+        raffle = crud.select_raffle_by_id(raffle_id, session)
+        crud.select_raffle_numbers(raffle, session)
+
+
+@plan_check("select_job_by_id")
+def _(session: Session):
+    jobs.select_job_by_id(SEED_OFFSET + 1, session)
+
+
+@plan_check("select_queue_depth")
+def _(session: Session):
+    jobs.select_queue_depth(session)
+
+
+def seed(connection) -> None:
+    now = datetime.utcnow()
+    connection.execute(
+        insert(User.__table__),
+        [
+            {
+                "id": SEED_OFFSET + i,
+                "username": f"plan-check-{i}",
+                "fullname": f"Plan check {i}",
+                "age": None,
+                "password": None,
+                "image_path": None,
+                "is_active": True,
+            }
+            for i in range(1, SEED_USERS + 1)
+        ],
+    )
+    connection.execute(
+        insert(Role.__table__),
+        [
+            {"id": SEED_OFFSET + i, "name": f"plan-check-{i}", "is_active": True}
+            for i in range(1, 11)
+        ],
+    )
+    connection.execute(
+        insert(Raffle.__table__),
+        [
+            {
+                "id": SEED_OFFSET + i,
+                "title": f"plan-check-{i}",
+                "details": "",
+                "numbers": SEED_NUMBERS_PER_RAFFLE,
+                "state": i % 10 != 0,
+                "archived": i % 10 == 0,
+                "created_by": SEED_OFFSET + 1 + i % SEED_USERS,
+            }
+            for i in range(1, SEED_RAFFLES + 1)
+        ],
+    )
+    connection.execute(
+        insert(RaffleUserLink.__table__),
+        [
+            {
+                "id": SEED_OFFSET + i * SEED_NUMBERS_PER_RAFFLE + n,
+                "raffle_id": SEED_OFFSET + i,
+                "user_id": SEED_OFFSET + 1 + (i * n) % SEED_USERS,
+                "buyed_number": n,
+                "price": 1000,
+            }
+            for i in range(1, SEED_RAFFLES + 1)
+            for n in range(SEED_NUMBERS_PER_RAFFLE)
+        ],
+    )
+    rewards = [
+        {
+            "id": SEED_OFFSET + i * SEED_REWARDS_PER_RAFFLE + r,
+            "raffle_id": SEED_OFFSET + i,
+            "name": f"reward-{r}",
+        }
+        for i in range(1, SEED_RAFFLES + 1)
+        for r in range(SEED_REWARDS_PER_RAFFLE)
+    ]
+    connection.execute(insert(RaffleRewards.__table__), rewards)
+    connection.execute(
+        insert(RewardUserLink.__table__),
+        [
+            {
+                "id": reward["id"],
+                "reward_id": reward["id"],
+                "user_id": SEED_OFFSET + 1 + reward["id"] % SEED_USERS,
+            }
+            for reward in rewards
+        ],
+    )
+    # Closed raffles keep their history in the archive tables.
+    archive_offset = SEED_OFFSET * 2
+    connection.execute(
+        insert(RaffleUserLinkArchive.__table__),
+        [
+            {
+                "id": archive_offset + i * SEED_NUMBERS_PER_RAFFLE + n,
+                "raffle_id": SEED_OFFSET + i,
+                "user_id": SEED_OFFSET + 1 + (i * n) % SEED_USERS,
+                "buyed_number": n,
+                "price": 1000,
+            }
+            for i in range(10, SEED_RAFFLES + 1, 10)
+            for n in range(SEED_NUMBERS_PER_RAFFLE)
+        ],
+    )
+    archived_rewards = [
+        {
+            "id": archive_offset + i * SEED_REWARDS_PER_RAFFLE + r,
+            "raffle_id": SEED_OFFSET + i,
+            "name": f"reward-{r}",
+        }
+        for i in range(10, SEED_RAFFLES + 1, 10)
+        for r in range(SEED_REWARDS_PER_RAFFLE)
+    ]
+    connection.execute(insert(RaffleRewardsArchive.__table__), archived_rewards)
+    connection.execute(
+        insert(RewardUserLinkArchive.__table__),
+        [
+            {
+                "id": reward["id"],
+                "reward_id": reward["id"],
+                "user_id": SEED_OFFSET + 1 + reward["id"] % SEED_USERS,
+            }
+            for reward in archived_rewards
+        ],
+    )
+    connection.execute(
+        insert(Job.__table__),
+        [
+            {
+                "id": SEED_OFFSET + i,
+                "job_type": "plan_check",
+                "payload": {},
+                "status": JobStatus.done if i % 100 else JobStatus.pending,
+                "attempts": 1,
+                "max_attempts": 5,
+                "last_error": None,
+                "locked_by": None,
+                "run_at": now,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(1, SEED_USERS + 1)
+        ],
+    )
+
+
+def capture_statements(connection, check: Callable[[Session], Any]) -> List[Tuple]:
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        check(Session(bind=connection))
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+    return statements
+
+
+def postgresql_seq_scans(connection, statement: str, parameters) -> List[str]:
+    plan = connection.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {statement}", parameters
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans = []
+    nodes = [(plan[0]["Plan"], False)]
+    while nodes:
+        node, reordered = nodes.pop()
+        node_type = node["Node Type"]
+        if node_type == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES:
+            scans.append(node["Relation Name"])
+        # A union that is sorted or grouped as a whole is read in full.
+        if node_type in ("Append", "Merge Append") and reordered:
+            scans.append("sorted union")
+        reordered = reordered or node_type in ("Sort", "Incremental Sort", "Aggregate")
+        nodes.extend((child, reordered) for child in node.get("Plans", []))
+    return scans
+
+
+def sqlite_seq_scans(connection, statement: str, parameters) -> List[str]:
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    details = [row[-1] for row in rows]
+    derived = any(
+        re.match(r"(CO-ROUTINE|MATERIALIZE|COMPOUND QUERY)", detail)
+        for detail in details
+    )
+    scans = []
+    for detail in details:
+        match = re.match(r"SCAN (?:TABLE |SUBQUERY )?(\S+)", detail)
+        if match and match.group(1) != "CONSTANT":
+            name = match.group(1)
+            if name in LARGE_TABLES:
+                scans.append(name)
+            elif name not in SQLModel.metadata.tables:
+                scans.append(f"subquery {name}")
+        elif detail.startswith("USE TEMP B-TREE") and derived:
+            scans.append("sorted subquery")
+    return scans
+
+
+@pytest.fixture
+def seeded_connection():
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        seed(connection)
+        if engine.dialect.name == "postgresql":
+            connection.exec_driver_sql("ANALYZE")
+            # With sequential scans priced out, one still showing up in a
+            # plan means the planner had no usable index.
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        yield connection
+        transaction.rollback()
+
+
+@pytest.mark.parametrize("name", list(plan_checks))
+def test_query_plan_uses_indexes(seeded_connection, name):
+    if engine.dialect.name == "postgresql":
+        seq_scans = postgresql_seq_scans
+    else:
+        seq_scans = sqlite_seq_scans
+    scans = [
+        scan
+        for statement, parameters in capture_statements(
+            seeded_connection, plan_checks[name]
+        )
+        for scan in seq_scans(seeded_connection, statement, parameters)
+    ]
+    assert not scans, f"{name} reads in full: {', '.join(scans)}"
@@ -0,0 +1,113 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import crud
+from app.archive import archive_raffle, archive_raffle_tickets_batch
+from app.database import engine
+from app.main import app
+from app.models import Raffle, RaffleRewards, RaffleUserLink, RewardUserLink, Role, User
+from app.security import create_jwt
+
+
+def seed(session) -> None:
+    creator = Role(name="raffle_creator")
+    session.add(User(id=1, username="owner", fullname="Owner", roles=[creator]))
+    session.add(User(id=2, username="other", fullname="Other", roles=[creator]))
+    for raffle_id in range(1, 8):
+        session.add(
+            Raffle(
+                id=raffle_id,
+                title=f"raffle-{raffle_id}",
+                details="",
+                numbers=10,
+                state=raffle_id > 5,
+                created_by=1,
+            )
+        )
+        for number in range(3):
+            session.add(
+                RaffleUserLink(
+                    id=raffle_id * 10 + number,
+                    raffle_id=raffle_id,
+                    user_id=1 + (raffle_id + number) % 2,
+                    buyed_number=number,
+                    price=100 * raffle_id,
+                )
+            )
+        reward = RaffleRewards(id=raffle_id, raffle_id=raffle_id, name="first")
+        session.add(reward)
+        session.add(
+            RewardUserLink(id=raffle_id, reward_id=raffle_id, user_id=1 + raffle_id % 2)
+        )
+    session.commit()
+
+
+def history(session, user_id: int, limit: int):
+    pages, before = [], None
+    while True:
+        page = crud.select_user_raffles(user_id, session, before=before, limit=limit)
+        if not page:
+            return pages
+        pages.append(
+            [
+                (
+                    raffle.id,
+                    raffle.numbers_bought,
+                    raffle.total_spent,
+                    [reward.id for reward in raffle.winned_rewards],
+                )
+                for raffle in page
+            ]
+        )
+        before = page[-1].id
+
+
+def test_user_raffles_read_the_same_history_after_archival(session):
+    seed(session)
+    expected = {user_id: history(session, user_id, 2) for user_id in (1, 2)}
+    assert [raffle[0] for raffle in sum(expected[1], [])] == [7, 6, 5, 4, 3, 2, 1]
+
+    for raffle_id in (1, 3, 4):
+        archive_raffle(raffle_id, session)
+    # A raffle with only part of its tickets moved.
+    archive_raffle_tickets_batch(5, 1, session)
+
+    for user_id in (1, 2):
+        assert history(session, user_id, 2) == expected[user_id]
+
+
+def test_archive_endpoint_checks_owner_and_state(session):
+    seed(session)
+    client = TestClient(app)
+
+    def post(raffle_id: int, username: str):
+        token = create_jwt({"sub": username})
+        return client.post(
+            f"/raffles/{raffle_id}/archive",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    assert post(1, "other").status_code == 403
+    assert post(6, "owner").status_code == 400
+    assert post(1, "owner").status_code == 202
+    archive_raffle(1, session)
+    assert post(1, "owner").status_code == 409
+
+
+def test_user_raffles_count_tickets_moved_between_reads_once(session, monkeypatch):
+    seed(session)
+    expected = history(session, 1, 10)
+    select_user_tickets = crud._select_user_tickets
+
+    def archive_after_live_read(tickets, *args):
+        rows = select_user_tickets(tickets, *args)
+        if tickets is RaffleUserLink:
+            # Another worker archives the raffles between the two reads.
+            with Session(engine) as other:
+                for raffle_id in (1, 3):
+                    archive_raffle(raffle_id, other)
+        return rows
+
+    monkeypatch.setattr(crud, "_select_user_tickets", archive_after_live_read)
+
+    assert history(session, 1, 10) == expected
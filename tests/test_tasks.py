@@ -0,0 +1,59 @@
+import os
+from pathlib import Path
+
+import pytest
+from sqlalchemy import update
+
+from app import jobs, tasks
+from app.config import settings
+from app.models import Job, JobStatus, User
+from tests.test_jobs import run_worker
+
+
+def stage(content: bytes) -> str:
+    os.makedirs(settings.staging_dir, exist_ok=True)
+    staged_path = Path(settings.staging_dir) / "upload"
+    staged_path.write_bytes(content)
+    return str(staged_path)
+
+
+def test_store_user_image_retry_after_failed_update(session, monkeypatch):
+    session.add(User(id=1, username="user", fullname="User"))
+    session.commit()
+    payload = {"user_id": 1, "staged_path": stage(b"image"), "filename": "me.png"}
+    update_user = tasks.update_user
+    calls = []
+
+    def flaky_update_user(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+        return update_user(*args)
+
+    monkeypatch.setattr(tasks, "update_user", flaky_update_user)
+    with pytest.raises(RuntimeError):
+        tasks.store_user_image(payload)
+    tasks.store_user_image(payload)
+
+    session.expire_all()
+    image_path = session.get(User, 1).image_path
+    assert Path(image_path[1:]).read_bytes() == b"image"
+    assert not Path(payload["staged_path"]).exists()
+    assert image_path[1:].startswith(settings.storage_dir)
+
+
+def test_failed_store_user_image_discards_staged_upload(session):
+    # The user does not exist, so every attempt fails.
+    payload = {"user_id": 1, "staged_path": stage(b"image"), "filename": "me.png"}
+    job_db = jobs.insert_job("store_user_image", payload, session)
+    session.execute(update(Job).where(Job.id == job_db.id).values(max_attempts=1))
+    session.commit()
+
+    def failed() -> bool:
+        session.expire_all()
+        return jobs.select_job_by_id(job_db.id, session).status == JobStatus.failed
+
+    run_worker(failed)
+
+    assert failed()
+    assert not Path(payload["staged_path"]).exists()
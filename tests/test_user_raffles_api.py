@@ -0,0 +1,82 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models import Raffle, RaffleUserLink, Role, User
+from app.security import create_jwt
+
+
+@pytest.fixture
+def client(session):
+    session.add(User(id=1, username="buyer", fullname="Buyer"))
+    session.add(
+        User(
+            id=2,
+            username="admin",
+            fullname="Admin",
+            roles=[Role(name="user_manager")],
+        )
+    )
+    for raffle_id in range(1, 4):
+        session.add(
+            Raffle(
+                id=raffle_id,
+                title=f"raffle-{raffle_id}",
+                details="",
+                numbers=10,
+                created_by=2,
+            )
+        )
+        session.add(
+            RaffleUserLink(
+                id=raffle_id, raffle_id=raffle_id, user_id=1, buyed_number=5, price=100
+            )
+        )
+    session.commit()
+    return TestClient(app)
+
+
+def get(client: TestClient, path: str, username: str, **params):
+    token = create_jwt({"sub": username})
+    return client.get(path, params=params, headers={"Authorization": f"Bearer {token}"})
+
+
+def page(response):
+    assert response.status_code == 200
+    body = response.json()
+    return [item["id"] for item in body["items"]], body["next_cursor"]
+
+
+def test_me_route_is_not_taken_for_a_user_id(client):
+    # A buyer without the user_manager role reaches their own history.
+    response = get(client, "/users/me/raffles", "buyer")
+
+    assert page(response) == ([3, 2, 1], None)
+    assert response.json()["items"][0]["numbers_bought"] == [5]
+
+
+def test_next_cursor_only_on_full_pages(client):
+    assert page(get(client, "/users/me/raffles", "buyer", limit=2)) == ([3, 2], 2)
+    assert page(get(client, "/users/me/raffles", "buyer", limit=2, before=2)) == (
+        [1],
+        None,
+    )
+    assert page(get(client, "/users/me/raffles", "admin")) == ([], None)
+
+
+@pytest.mark.parametrize(
+    "limit, status_code", [(0, 422), (1, 200), (100, 200), (101, 422)]
+)
+def test_limit_bounds(client, limit, status_code):
+    for path, username in (
+        ("/users/me/raffles", "buyer"),
+        ("/users/1/raffles", "admin"),
+    ):
+        response = get(client, path, username, limit=limit)
+        assert response.status_code == status_code
+
+
+def test_admin_reads_other_users_history(client):
+    assert page(get(client, "/users/1/raffles", "admin", limit=1)) == ([3], 3)
+    assert get(client, "/users/99/raffles", "admin").status_code == 404
+    assert get(client, "/users/1/raffles", "buyer").status_code == 403